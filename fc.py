@@ -1,13 +1,53 @@
 import os
-import shutil
+import shelve
+import time
+import functools
 from datetime import datetime
 import re
-from math import radians, cos, sin, asin, sqrt
+import math
+import numpy as np
 import argparse
-from PIL import Image
-from PIL.ExifTags import TAGS, GPSTAGS
+import logging
+import sys
+from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
+import exifread
+try:
+    from exifread.core.ifd_tag import IfdTag
+except ImportError:  # exifread < 3.1
+    from exifread.classes import IfdTag
+import xxhash
+from geopy.adapters import RequestsAdapter
 from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+from geopy.extra.rate_limiter import RateLimiter
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+GEOCACHE_PATH = os.path.expanduser("~/.cache/fc_geocache.db")
+NEGATIVE_CACHE_TTL = 15 * 60  # Seconds before a failed geocoding lookup is retried
+
+# exifread warns about every file without EXIF data
+logging.getLogger('exifread').setLevel(logging.ERROR)
+
+# Nominatim allows at most 1 request per second, throttle on the client side.
+# A pooled requests session keeps the connection alive between lookups
+geolocator = Nominatim(user_agent="image_organizer_script", timeout=15,
+                       adapter_factory=functools.partial(RequestsAdapter, pool_connections=1, pool_maxsize=4))
+reverse = RateLimiter(geolocator.reverse, min_delay_seconds=1.05, max_retries=3,
+                      error_wait_seconds=5, swallow_exceptions=False)
+
+# Nominatim address fields naming a place, in order of preference
+_CITY_KEYS = ('city', 'town', 'village', 'hamlet', 'suburb', 'county')
+
+# Image file names as enforced by fr.py: img_<DATE>_<ID>.<EXT>
+_IMG_RE = re.compile(r'img_(\d{8}_\d{6})_(\d+)\.(\w+)')
+_UNSAFE_CHARS_RE = re.compile(r'[^\w\-]')
+
+# Per-file messages are logged at DEBUG level, shown with --verbose
+logger = logging.getLogger(__name__)
 
 def format_size(size):
     if size < 1024:
@@ -20,34 +60,93 @@ def format_size(size):
         return f"{size / (1024 * 1024 * 1024):.2f} GB"
 
 
-# Function to calculate distance between two GPS coordinates (Haversine formula)
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Earth's radius in kilometers
-    dLat = radians(lat2 - lat1)
-    dLon = radians(lon2 - lon1)
-    lat1 = radians(lat1)
-    lat2 = radians(lat2)
-    a = sin(dLat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dLon / 2) ** 2
-    c = 2 * asin(sqrt(a))
-    return R * c
+EARTH_RADIUS = 6371  # Earth's radius in kilometers
+KM_PER_DEGREE = 2 * math.pi * EARTH_RADIUS / 360
+FP_SCALE = 100000  # Fixed-point scale for coordinates (1e-5 degree, ~1 m)
+
+# Function to calculate distances between pairs of GPS coordinates (Haversine formula)
+# Missing coordinates are NaN and yield NaN distances
+def pair_distances(lat1, lon1, lat2, lon2):
+    if njit is not None:
+        return _pair_distances_nb(lat1, lon1, lat2, lon2)
+    dLat = np.radians(lat2 - lat1)
+    dLon = np.radians(lon2 - lon1)
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    a = np.sin(dLat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dLon / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+# Function to flag pictures without usable GPS coordinates (either one is NaN)
+def missing_gps(lats, lons):
+    return np.isnan(lats) | np.isnan(lons)
+
+# Function to check whether consecutive GPS coordinates are less than threshold km apart
+# A fixed-point equirectangular approximation settles clear cases, the exact distance
+# is only computed for pairs between half and twice the threshold.
+# Pairs with a missing coordinate are never within threshold
+def consecutive_within(lats, lons, threshold):
+    no_gps = missing_gps(lats, lons)
+    lat_fp = np.where(no_gps, 0, np.round(lats * FP_SCALE)).astype(np.int32)
+    lon_fp = np.where(no_gps, 0, np.round(lons * FP_SCALE)).astype(np.int32)
+    dlat = np.diff(lat_fp).astype(np.int64)
+    # Wrap longitude differences around the antimeridian
+    dlon = (np.diff(lon_fp).astype(np.int64) + 180 * FP_SCALE) % (360 * FP_SCALE) - 180 * FP_SCALE
+    cos_lat = np.cos(np.radians((lat_fp[:-1] + lat_fp[1:]) / (2 * FP_SCALE)))
+    approx_sq = dlat * dlat + (dlon * cos_lat) ** 2
+
+    threshold_fp = threshold / KM_PER_DEGREE * FP_SCALE
+    within = approx_sq < (threshold_fp / 2) ** 2
+    borderline = np.flatnonzero(~within & (approx_sq < (2 * threshold_fp) ** 2))
+    if borderline.size:
+        within[borderline] = pair_distances(lats[borderline], lons[borderline],
+                                            lats[borderline + 1], lons[borderline + 1]) < threshold
+    return within & ~no_gps[:-1] & ~no_gps[1:]
+
+# Numba-compiled kernels, used when numba is installed
+# fastmath flags exclude nnan/ninf so missing coordinates still propagate as NaN
+if njit is not None:
+    _FASTMATH = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+    @njit(cache=True, fastmath=_FASTMATH)
+    def _haversine_nb(lat1, lon1, lat2, lon2):
+        dLat = math.radians(lat2 - lat1)
+        dLon = math.radians(lon2 - lon1)
+        lat1 = math.radians(lat1)
+        lat2 = math.radians(lat2)
+        a = math.sin(dLat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dLon / 2) ** 2
+        return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+    @njit(cache=True, fastmath=_FASTMATH)
+    def _pair_distances_nb(lat1, lon1, lat2, lon2):
+        distances = np.empty(len(lat1))
+        for i in range(len(distances)):
+            distances[i] = _haversine_nb(lat1[i], lon1[i], lat2[i], lon2[i])
+        return distances
 
 # Function to extract EXIF data from an image
+# Only the EXIF segment is read, the image itself is never decoded
 def get_exif_data(image_path):
     try:
-        image = Image.open(image_path)
-        info = image._getexif()
+        with open(image_path, 'rb') as f:
+            tags = exifread.process_file(f, details=False, extract_thumbnail=False, stop_tag='GPSLongitude')
         exif_data = {}
-        if info:
-            for tag, value in info.items():
-                decoded = TAGS.get(tag, tag)
-                if decoded == "GPSInfo":
-                    gps_data = {}
-                    for t in value:
-                        sub_decoded = GPSTAGS.get(t, t)
-                        gps_data[sub_decoded] = value[t]
-                    exif_data[decoded] = gps_data
-                else:
-                    exif_data[decoded] = value
+        gps_data = {}
+        for key, tag in tags.items():
+            # Skip raw entries such as thumbnails, only IFD tags carry values
+            if not isinstance(tag, IfdTag):
+                continue
+            ifd, _, name = key.partition(' ')
+            values = tag.values
+            if isinstance(values, list):
+                # Rationals are converted to floats, a zero denominator gives NaN like PIL
+                values = [(v.num / v.den if v.den else float('nan')) if hasattr(v, 'den') else v
+                          for v in values]
+            if ifd == 'GPS':
+                gps_data[name] = values
+            else:
+                exif_data[name] = values
+        if gps_data:
+            exif_data['GPSInfo'] = gps_data
         return exif_data
     except Exception:
         return {}
@@ -67,169 +166,237 @@ def get_gps_info(image_path):
             return (lat, lon)
     return None
 
+# Decorator caching geocoding results in memory and on disk.
+# Coordinates are rounded to 4 decimals (~11 m grid) so nearby photos share an entry.
+# The wrapped function returns None on failure; failures are cached for NEGATIVE_CACHE_TTL.
+def geocache(func):
+    @functools.lru_cache(maxsize=None)
+    def cached(lat, lon):
+        key = f"{lat}:{lon}"
+        try:
+            with shelve.open(GEOCACHE_PATH) as db:
+                entry = db.get(key)
+        except Exception:
+            entry = None
+        if entry is not None:
+            if entry['city'] is not None or time.time() - entry['ts'] < NEGATIVE_CACHE_TTL:
+                return entry['city'] or 'Unknown'
+
+        city = func(lat, lon)
+        try:
+            os.makedirs(os.path.dirname(GEOCACHE_PATH), exist_ok=True)
+            # Closing the shelf flushes the entry to disk (best effort, no fsync)
+            with shelve.open(GEOCACHE_PATH) as db:
+                db[key] = {'city': city, 'ts': time.time()}
+        except Exception as e:
+            print(f"Cannot write geocoding cache {GEOCACHE_PATH}: {e}")
+        return city or 'Unknown'
+
+    @functools.wraps(func)
+    def wrapper(lat, lon):
+        return cached(round(lat, 4), round(lon, 4))
+    return wrapper
+
 # Function to get city name from GPS coordinates
+@geocache
 def get_city_from_coords(lat, lon):
-    geolocator = Nominatim(user_agent="image_organizer_script")
     try:
-        location = geolocator.reverse((lat, lon), language='en')
+        location = reverse((lat, lon), language='en')
         if location and 'address' in location.raw:
             address = location.raw['address']
-            return address.get('city') or address.get('town') or address.get('village') or 'Unknown'
+            return next((address[k] for k in _CITY_KEYS if address.get(k)), 'Unknown')
         return 'Unknown'
     except (GeocoderTimedOut, GeocoderUnavailable) as e:
         print(f"Geocoding failed for ({lat}, {lon}): {e}")
-        return 'Unknown'
+        return None
 
-# Function to identify duplicates based on prefix and size
-def identify_duplicates(folder_path, image_files):
-    prefix_size_to_files = {}
-    for file in image_files:
-        match = re.match(r'(img_\d{8}_\d{6})_\d+\.\w+', file)
-        if match:
-            prefix = match.group(1)
-            file_path = os.path.join(folder_path, file)
-            try:
-                size = os.path.getsize(file_path)
-                key = (prefix, size)
-                if key not in prefix_size_to_files:
-                    prefix_size_to_files[key] = []
-                prefix_size_to_files[key].append(file)
-            except OSError:
-                print(f"Cannot access {file_path}")
-                continue
+# Generator streaming the image files of a folder with their file name match
+def _iter_imgs(folder_path):
+    with os.scandir(folder_path) as it:
+        for entry in it:
+            match = _IMG_RE.match(entry.name)
+            if match and entry.is_file(follow_symlinks=False):
+                yield entry, match
+
+# Function to hash the first 64 KiB of a file, None if it cannot be read
+def head_hash(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            return xxhash.xxh3_64(f.read(65536)).intdigest()
+    except OSError:
+        print(f"Cannot access {file_path}")
+        return None
+
+# Function to identify duplicates based on prefix, size and content
+# Returns the files to remove and the files to keep
+# sizes and date_strs map each image file name to its size in bytes and date prefix
+def identify_duplicates(folder_prefix, sizes, date_strs):
+    prefix_size_to_files = defaultdict(list)
+    for file, size in sizes.items():
+        prefix_size_to_files[(date_strs[file], size)].append(file)
     
-    files_to_remove = set()
+    files_to_remove = []
+    files_to_keep = []
     for (prefix, size), files in prefix_size_to_files.items():
-        if len(files) > 1:
-            # Keep the first file, mark others for removal
-            for file in files[1:]:
-                files_to_remove.add(file)
-    return files_to_remove
+        if len(files) == 1:
+            files_to_keep.append(files[0])
+            continue
+        # Burst shots can share prefix and size, only files with the same content
+        # hash are duplicates. Keep the first file of each hash, mark others for removal
+        hash_to_files = defaultdict(list)
+        for file in files:
+            h = head_hash(folder_prefix + file)
+            if h is None:
+                files_to_keep.append(file)
+            else:
+                hash_to_files[h].append(file)
+        for same_hash in hash_to_files.values():
+            files_to_keep.append(same_hash[0])
+            files_to_remove.extend(same_hash[1:])
+    return files_to_remove, files_to_keep
+
+# Function to parse a YYYYMMDD_HHmmss timestamp, faster than datetime.strptime
+def _parse_ts(s):
+    return datetime(int(s[:4]), int(s[4:6]), int(s[6:8]), int(s[9:11]), int(s[11:13]), int(s[13:15]))
+
+# Function to extract date and GPS coordinates for a single file
+def extract_picture_info(folder_prefix, file, date_str):
+    try:
+        date_obj = _parse_ts(date_str)
+    except ValueError:
+        print(f"Skipping file with invalid date: {file}")
+        return None
+    # Runs in a worker thread, an error must not abort the whole run
+    try:
+        gps = get_gps_info(folder_prefix + file)
+    except Exception as e:
+        print(f"Skipping file {file}: {e}")
+        return None
+    return file, date_obj, gps
+
+# Function to get the geocoding grid cell (~11 m) of GPS coordinates
+def grid_cell(lat, lon):
+    return (round(float(lat), 4), round(float(lon), 4))
 
 # Function to sanitize folder names
 def sanitize_folder_name(name):
-    return re.sub(r'[^\w\-]', '_', name)
+    return _UNSAFE_CHARS_RE.sub('_', name)
 
 # Main script
 def organize_images(folder_path, dry_run=False):
     threshold = 50  # Distance threshold in kilometers for same location
 
-    # List image files
-    image_files = [f for f in os.listdir(folder_path) if re.match(r'img_\d{8}_\d{6}_\d+\.\w+', f)]
+    # Paths are built by concatenation with the folder prefix in the per-file loops
+    folder_prefix = os.path.join(folder_path, '')
+
+    # List image files and their sizes in a single directory pass
+    sizes = {}
+    date_strs = {}
+    for entry, match in _iter_imgs(folder_path):
+        try:
+            sizes[entry.name] = entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            print(f"Cannot access {entry.path}")
+            continue
+        date_strs[entry.name] = match.group(1)
     
     # Identify duplicates
-    files_to_remove = identify_duplicates(folder_path, image_files)
+    files_to_remove, files_to_process = identify_duplicates(folder_prefix, sizes, date_strs)
     
     # Compute total freed memory
-    total_memory_freed = 0
-    for file in files_to_remove:
-        file_path = os.path.join(folder_path, file)
-        try:
-            total_memory_freed += os.path.getsize(file_path)
-        except OSError:
-            print(f"Cannot access {file_path}")
+    total_memory_freed = sum(sizes[file] for file in files_to_remove)
 
     if dry_run:
         if files_to_remove:
-            print("Would remove the following duplicate files:")
-            for file in files_to_remove:
-                print(f"  {file} {format_size(os.path.getsize(os.path.join(folder_path, file)))}")
-        files_to_process = [f for f in image_files if f not in files_to_remove]
+            print(f"Would remove {len(files_to_remove)} duplicate files")
+            if logger.isEnabledFor(logging.DEBUG):
+                for file in files_to_remove:
+                    logger.debug("  %s %s", file, format_size(sizes[file]))
     else:
         for file in files_to_remove:
-            file_path = os.path.join(folder_path, file)
+            file_path = folder_prefix + file
             try:
                 os.remove(file_path)
-                print(f"Removed duplicate file: {file}")
+                logger.debug("Removed duplicate file: %s", file)
             except OSError as e:
                 print(f"Error removing {file_path}: {e}")
-        files_to_process = [f for f in image_files if f not in files_to_remove]
-    
-    # Extract date, GPS, and location for each file
-    pictures = []
-    for file in files_to_process:
-        match = re.match(r'img_(\d{8}_\d{6})_\d+\.\w+', file)
-        if match:
-            date_str = match.group(1)
-            try:
-                date_obj = datetime.strptime(date_str, '%Y%m%d_%H%M%S')
-                gps = get_gps_info(os.path.join(folder_path, file))
-                if gps:
-                    lat, lon = gps
-                    location = get_city_from_coords(lat, lon)
-                else:
-                    location = "Unknown"
-                pictures.append({'filename': file, 'date': date_obj, 'gps': gps, 'location': location})
-            except ValueError:
-                print(f"Skipping file with invalid date: {file}")
-                continue
     
-    # Group pictures by year
-    pictures_by_year = {}
-    for pic in pictures:
-        year = pic['date'].year
-        if year not in pictures_by_year:
-            pictures_by_year[year] = []
-        pictures_by_year[year].append(pic)
-    
-    # Process each year
-    for year, pics in pictures_by_year.items():
-        # Sort by date
-        pics.sort(key=lambda x: x['date'])
-        
-        # Group into trips
-        trips = []
-        if pics:
-            current_trip = [pics[0]]
-            for i in range(1, len(pics)):
-                prev_pic = pics[i - 1]
-                curr_pic = pics[i]
-                date_diff = (curr_pic['date'].date() - prev_pic['date'].date()).days
-                same_location = (
-                    (prev_pic['gps'] is not None and curr_pic['gps'] is not None and
-                     haversine(prev_pic['gps'][0], prev_pic['gps'][1], curr_pic['gps'][0], curr_pic['gps'][1]) < threshold)
-                    or
-                    (prev_pic['gps'] is None and curr_pic['gps'] is None and
-                     prev_pic['location'] == curr_pic['location'])
-                )
-                if (date_diff == 0 or date_diff == 1) and same_location:
-                    current_trip.append(curr_pic)
-                else:
-                    trips.append(current_trip)
-                    current_trip = [curr_pic]
-            trips.append(current_trip)
+    # Extract date and GPS for each file in parallel (I/O bound)
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        results = list(executor.map(lambda f: extract_picture_info(folder_prefix, f, date_strs[f]), files_to_process))
+
+    # Store pictures as parallel arrays, skipping invalid files
+    results = [result for result in results if result]
+    filenames = [file for file, _, _ in results]
+    timestamps = np.array([date_obj for _, date_obj, _ in results], dtype='datetime64[s]')
+    lats = np.array([gps[0] if gps else np.nan for _, _, gps in results], dtype=np.float64)
+    lons = np.array([gps[1] if gps else np.nan for _, _, gps in results], dtype=np.float64)
+
+    # Sort by date
+    order = np.argsort(timestamps, kind='stable')
+    filenames = [filenames[i] for i in order]
+    timestamps = timestamps[order]
+    lats = lats[order]
+    lons = lons[order]
+    years = timestamps.astype('datetime64[Y]').astype(np.int64) + 1970
+    months = timestamps.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    days = timestamps.astype('datetime64[D]').astype(np.int64)
+
+    # Compare consecutive pictures in bulk: same trip if taken in the same year, on the
+    # same or next day, at the same location (both within threshold or both without GPS)
+    no_gps = missing_gps(lats, lons)
+    date_diff = np.diff(days)
+    same_location = consecutive_within(lats, lons, threshold) | (no_gps[:-1] & no_gps[1:])
+    same_trip = (np.diff(years) == 0) & ((date_diff == 0) | (date_diff == 1)) & same_location
+
+    # Group into trips as index ranges, splitting wherever consecutive pictures differ
+    boundaries = [0, *(np.flatnonzero(~same_trip) + 1).tolist(), len(filenames)] if filenames else []
+    trips = list(zip(boundaries[:-1], boundaries[1:]))
+
+    # Resolve the location of each trip's first picture, once per unique grid cell
+    # and sequentially to respect the geocoding rate limit
+    heads = {grid_cell(lats[start], lons[start]) for start, _ in trips if not no_gps[start]}
+    city_map = {cell: get_city_from_coords(*cell) for cell in heads}
+
+    # Assign folder names and move files
+    name_dict = Counter()
+    moved = 0
+    for start, end in trips:
+        YYYY = int(years[start])
+        MM = f"{months[start]:02d}"
+        location = 'Unknown' if no_gps[start] else city_map[grid_cell(lats[start], lons[start])]
+        LOCATION = sanitize_folder_name(location)
+
+        base_name = f"{YYYY}_{MM}_{LOCATION}"
+        name_dict[base_name] += 1
+        n = name_dict[base_name]
+        # First folder gets the base name, the next ones are suffixed _0, _1, ...
+        folder_name = base_name if n == 1 else f"{base_name}_{n - 2}"
+
+        trip_folder = f"{folder_prefix}{YYYY}{os.sep}{folder_name}"
+        trip_folder_prefix = trip_folder + os.sep
         
-        # Assign folder names and move files
-        name_dict = {}
-        for trip in trips:
-            starting_date = trip[0]['date']
-            YYYY = starting_date.year
-            MM = f"{starting_date.month:02d}"
-            LOCATION = sanitize_folder_name(trip[0]['location'])
-            
-            base_name = f"{YYYY}_{MM}_{LOCATION}"
-            if base_name not in name_dict:
-                folder_name = base_name
-                name_dict[base_name] = 0
-            else:
-                X = name_dict[base_name]
-                folder_name = f"{base_name}_{X}"
-                name_dict[base_name] += 1
-            
-            year_folder = os.path.join(folder_path, str(year))
-            trip_folder = os.path.join(year_folder, folder_name)
-            
-            if dry_run:
-                print(f"Would create folder: {trip_folder}")
-                for pic in trip:
-                    print(f"Would move {pic['filename']} to {trip_folder}")
-            else:
-                os.makedirs(trip_folder, exist_ok=True)
-                for pic in trip:
-                    src = os.path.join(folder_path, pic['filename'])
-                    dst = os.path.join(trip_folder, pic['filename'])
-                    shutil.move(src, dst)
-                    print(f"Moved {pic['filename']} to {trip_folder}")
+        if dry_run:
+            print(f"Would create folder: {trip_folder}")
+            for filename in filenames[start:end]:
+                logger.debug("Would move %s to %s", filename, trip_folder)
+        else:
+            os.makedirs(trip_folder, exist_ok=True)
+            for filename in filenames[start:end]:
+                src = folder_prefix + filename
+                dst = trip_folder_prefix + filename
+                try:
+                    # Same filesystem, a plain rename is enough
+                    os.replace(src, dst)
+                    moved += 1
+                    logger.debug("Moved %s to %s", filename, trip_folder)
+                except OSError as e:
+                    print(f"Error moving {src} to {dst}: {e}")
+
+    if dry_run:
+        print(f"Would move {len(filenames)} files into {len(trips)} folders")
+    else:
+        print(f"Moved {moved} files into {len(trips)} folders")
 
     if total_memory_freed > 0:
         if dry_run:
@@ -242,6 +409,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Organize images into folders based on date and location, with duplicate removal.')
     parser.add_argument('folder_path', help='Path to the folder containing the images')
     parser.add_argument('--dry-run', action='store_true', help='Simulate the actions without modifying the file system')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print an entry for every file removed or moved')
     args = parser.parse_args()
 
+    logging.basicConfig(stream=sys.stdout, format='%(message)s', level=logging.INFO)
+    # Only this script's per-file messages, not geopy's or urllib3's debug output
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
     organize_images(args.folder_path, dry_run=args.dry_run)
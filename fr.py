@@ -1,7 +1,16 @@
+import logging
 import os
+import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from PIL import Image
+import exifread
+
+# exifread warns about every file without EXIF data
+logging.getLogger('exifread').setLevel(logging.ERROR)
+
+# EXIF date format: "YYYY:MM:DD HH:MM:SS"
+_EXIF_DATE_RE = re.compile(r'(\d{4}):(\d{2}):(\d{2}) (\d{2}):(\d{2}):(\d{2})')
 
 # Define common image file extensions (case-insensitive)
 image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff']
@@ -19,6 +28,21 @@ def is_image(file_path):
     ext = os.path.splitext(file_path)[1].lower()
     return ext in image_extensions
 
+def _parse_ts(s):
+    """
+    Parse a timestamp, faster than datetime.strptime.
+    
+    Args:
+        s (str): Date in YYYYMMDD_HHmmss format.
+    
+    Returns:
+        datetime: The parsed date.
+    
+    Raises:
+        ValueError: If the date is malformed.
+    """
+    return datetime(int(s[:4]), int(s[4:6]), int(s[6:8]), int(s[9:11]), int(s[11:13]), int(s[13:15]))
+
 def get_exif_date(file_path):
     """
     Extract the date taken from an image's EXIF data.
@@ -30,12 +54,19 @@ def get_exif_date(file_path):
         str or None: Date in YYYYMMDD_HHmmss format, or None if unavailable.
     """
     try:
-        with Image.open(file_path) as img:
-            exif_data = img._getexif()
-            if exif_data and 36867 in exif_data:  # 36867 is DateTimeOriginal tag
-                date_str = exif_data[36867]  # Format: "YYYY:MM:DD HH:MM:SS"
-                dt = datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S")
-                return dt.strftime("%Y%m%d_%H%M%S")
+        with open(file_path, 'rb') as f:
+            tags = exifread.process_file(f, details=False, extract_thumbnail=False, stop_tag='DateTimeOriginal')
+        if 'EXIF DateTimeOriginal' in tags:
+            date_str = str(tags['EXIF DateTimeOriginal'].values)  # Format: "YYYY:MM:DD HH:MM:SS"
+            match = _EXIF_DATE_RE.fullmatch(date_str.strip())
+            try:
+                dt = _parse_ts("{}{}{}_{}{}{}".format(*match.groups())) if match else None
+            except ValueError:
+                dt = None
+            if dt is None:
+                # Non-padded or malformed dates, strptime rejects trailing data
+                dt = datetime.strptime(date_str.strip(), "%Y:%m:%d %H:%M:%S")
+            return dt.strftime("%Y%m%d_%H%M%S")
     except Exception as e:
         print(f"Error getting EXIF data for {file_path}: {e}")
     return None
@@ -69,6 +100,21 @@ def get_file_date(file_path):
         return date
     return get_modification_date(file_path)
 
+def iter_images(folder_path):
+    """
+    Stream the image files of a folder, skipping directories and non-images.
+    
+    Args:
+        folder_path (str): Path to the folder to scan.
+    
+    Yields:
+        os.DirEntry: Directory entry of each image file.
+    """
+    with os.scandir(folder_path) as it:
+        for entry in it:
+            if entry.is_file() and is_image(entry.name):
+                yield entry
+
 def rename_files_in_folder(folder_path):
     """
     Rename all image files in the specified folder to the format img_X_Y.Z.
@@ -81,20 +127,15 @@ def rename_files_in_folder(folder_path):
         print(f"{folder_path} is not a directory.")
         sys.exit(1)
 
-    # Process each file in the folder
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        
-        # Skip if it's not a file (e.g., directories)
-        if not os.path.isfile(file_path):
-            continue
-        
-        # Skip if it's not an image
-        if not is_image(file_path):
-            continue
-        
-        # Get the date for the image file
-        date = get_file_date(file_path)
+    # Get the dates in parallel (I/O bound) while the folder is scanned,
+    # renaming stays sequential
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        dates = list(executor.map(lambda entry: (entry.name, get_file_date(entry.path)), iter_images(folder_path)))
+
+    # Paths are built by concatenation with the folder prefix in the per-file loop
+    folder_prefix = os.path.join(folder_path, '')
+    for filename, date in dates:
+        file_path = folder_prefix + filename
         if date is None:
             print(f"Could not determine date for {filename}, skipping.")
             continue
@@ -106,14 +147,14 @@ def rename_files_in_folder(folder_path):
         y = 0
         while True:
             new_name = f"img_{date}_{y}{ext}"
-            new_path = os.path.join(folder_path, new_name)
+            new_path = folder_prefix + new_name
             if not os.path.exists(new_path):
                 break
             y += 1
         
         # Rename the file
         try:
-            os.rename(file_path, new_path)
+            os.replace(file_path, new_path)
             print(f"Renamed {filename} to {new_name}")
         except Exception as e:
             print(f"Error renaming {filename} to {new_name}: {e}")